@@ -1,6 +1,11 @@
 import os
 import glob
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 
 DATA_DIR = "DATA"
@@ -8,19 +13,84 @@ REQUIRED_COLS = [
     "TimeStamp", "Turn", "Speaker", "Sentence",
     "Teacher_Tag", "Student_Tag", "DialogAct"
 ]
+PREVIEW_COLS = [
+    "lesson_id", "TimeStamp", "Turn",
+    "Speaker", "role",
+    "Sentence", "Teacher_Tag",
+    "Student_Tag", "DialogAct"
+]
+# Bump when read_lesson_table changes how workbooks are parsed.
+SIDECAR_VERSION = 2
+# Bump when merge_lesson_tables changes the merged output.
+MERGED_CACHE_VERSION = 1
+COUNT_KEYS = ["role", "DialogAct", "Teacher_Tag", "Student_Tag"]
+TEACHER_SPEAKERS = frozenset({"t", "teacher", "instructor"})
 
 
 # -----------------------
 # Utility
 # -----------------------
 
-def get_role(speaker: str) -> str:
-    s = (speaker or "").strip().lower()
-    if s in {"t", "teacher", "instructor"}:
-        return "teacher"
-    if "teacher" in s:
-        return "teacher"
-    return "student"
+def write_parquet(df: pd.DataFrame, path: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def read_lesson_table(path: str) -> pa.Table:
+    cache_path = f"{path}.v{SIDECAR_VERSION}.parquet"
+    if (
+        not os.path.exists(cache_path)
+        or os.path.getmtime(cache_path) < os.path.getmtime(path)
+    ):
+        df = pd.read_excel(
+            path,
+            engine="calamine",
+            sheet_name=0,
+            usecols=REQUIRED_COLS,
+            dtype={c: "string[pyarrow]" for c in REQUIRED_COLS}
+        )
+        write_parquet(df, cache_path)
+    table = pq.read_table(cache_path, columns=REQUIRED_COLS)
+    lesson_id = os.path.splitext(os.path.basename(path))[0]
+    return table.append_column(
+        "lesson_id", pa.array([lesson_id] * table.num_rows, pa.string())
+    )
+
+
+def merge_lesson_tables(xlsx_files: list) -> pd.DataFrame:
+    with ThreadPoolExecutor(max_workers=min(8, len(xlsx_files))) as ex:
+        tables = list(ex.map(read_lesson_table, xlsx_files))
+
+    string_dtype = pd.StringDtype("pyarrow")
+    data = pa.concat_tables(tables, promote_options="permissive").to_pandas(
+        types_mapper={
+            pa.string(): string_dtype,
+            pa.large_string(): string_dtype,
+        }.get
+    )
+
+    cols = ["Speaker", "Sentence", "Teacher_Tag", "Student_Tag", "DialogAct"]
+    data[cols] = data[cols].apply(lambda s: s.str.strip())
+
+    for c in ["Teacher_Tag", "Student_Tag", "DialogAct"]:
+        data[c] = data[c].astype("category")
+
+    data["lesson_id"] = data["lesson_id"].astype("category")
+    data["Turn_num"] = pd.to_numeric(data["Turn"], errors="coerce")
+    data = data.sort_values(by=["lesson_id", "Turn_num"]).reset_index(drop=True)
+
+    s = data["Speaker"].str.lower()
+    is_teacher = (
+        s.isin(TEACHER_SPEAKERS)
+        | s.str.contains("teacher", na=False)
+    )
+    data["role"] = pd.Categorical(
+        np.where(is_teacher, "teacher", "student"),
+        categories=["teacher", "student"]
+    )
+
+    return data
 
 
 @st.cache_data(show_spinner=False)
@@ -30,23 +100,110 @@ def load_and_merge_xlsx(data_dir: str) -> pd.DataFrame:
         if not os.path.basename(f).startswith("~$")
     ]
 
-    dfs = []
-    for path in xlsx_files:
-        df = pd.read_excel(path, engine="openpyxl")
-        lesson_id = os.path.splitext(os.path.basename(path))[0]
-        df["lesson_id"] = lesson_id
-        dfs.append(df[REQUIRED_COLS + ["lesson_id"]])
+    sig = hashlib.sha1(repr((
+        SIDECAR_VERSION,
+        MERGED_CACHE_VERSION,
+        sorted(
+            (p, os.path.getmtime(p), os.path.getsize(p)) for p in xlsx_files
+        ),
+    )).encode()).hexdigest()[:16]
+    cache_path = os.path.join(data_dir, f".merged_{sig}.parquet")
+
+    if os.path.exists(cache_path):
+        data = pd.read_parquet(cache_path, engine="pyarrow")
+    else:
+        data = merge_lesson_tables(xlsx_files)
+        write_parquet(data, cache_path)
+        for stale in glob.glob(os.path.join(data_dir, ".merged_*.parquet")):
+            if stale != cache_path:
+                os.remove(stale)
 
-    data = pd.concat(dfs, ignore_index=True)
+    return data
 
-    for c in ["Speaker", "Sentence", "Teacher_Tag", "Student_Tag", "DialogAct"]:
-        data[c] = data[c].astype("string").str.strip()
 
-    data["Turn_num"] = pd.to_numeric(data["Turn"], errors="coerce")
-    data = data.sort_values(by=["lesson_id", "Turn_num"]).reset_index(drop=True)
-    data["role"] = data["Speaker"].apply(get_role)
+@st.cache_data(show_spinner=False)
+def preview_table(selected_lessons: tuple) -> pa.Table:
+    data = load_and_merge_xlsx(DATA_DIR)
+    rows = np.flatnonzero(data["lesson_id"].isin(selected_lessons))[:50]
+    return pa.Table.from_pandas(
+        data.iloc[rows][PREVIEW_COLS], preserve_index=False
+    )
 
-    return data
+
+@st.cache_data(show_spinner=False)
+def lesson_counts(data_dir: str) -> pd.Series:
+    data = load_and_merge_xlsx(data_dir)
+    return data.groupby(
+        ["lesson_id"] + COUNT_KEYS, observed=True, dropna=False
+    ).size()
+
+
+@st.cache_data(show_spinner=False)
+def compute_aggregates(selected_lessons: tuple) -> dict:
+    per_lesson = lesson_counts(DATA_DIR)
+    in_selection = per_lesson.index.get_level_values("lesson_id").isin(
+        selected_lessons
+    )
+
+    counts = (
+        per_lesson[in_selection]
+        .groupby(level=COUNT_KEYS, observed=True, dropna=False)
+        .sum()
+    )
+    role = counts.index.get_level_values("role")
+
+    rq1_turns = (
+        counts.groupby(level="role", observed=True)
+        .sum()
+        .reset_index(name="turn_count")
+    )
+
+    da_counts = (
+        counts.groupby(level="DialogAct", observed=True)
+        .sum()
+        .nlargest(10)
+        .reset_index(name="count")
+    )
+
+    st_counts = (
+        counts[role == "student"]
+        .groupby(level="Student_Tag", observed=True)
+        .sum()
+        .nlargest(10)
+        .reset_index(name="count")
+    )
+
+    ct_counts = (
+        counts[role == "teacher"]
+        .groupby(level=["Teacher_Tag", "DialogAct"], observed=True)
+        .sum()
+    )
+
+    ct_props = (
+        ct_counts / ct_counts.groupby(level=0, observed=True).transform("sum")
+    ).unstack("DialogAct", fill_value=0.0)
+
+    return {
+        "rq1_turns": rq1_turns,
+        "da_counts": da_counts,
+        "st_counts": st_counts,
+        "ct_props": ct_props,
+    }
+
+
+@st.cache_data(show_spinner=False)
+def chart_records(df: pd.DataFrame) -> list:
+    return df.to_dict(orient="records")
+
+
+@st.cache_data(show_spinner=False)
+def heatmap_records(df_props: pd.DataFrame) -> list:
+    return [
+        {"Teacher_Tag": r, "DialogAct": c, "Proportion": float(v)}
+        for r, row in zip(df_props.index, df_props.to_numpy())
+        for c, v in zip(df_props.columns, row)
+        if v == v
+    ]
 
 
 # -----------------------
@@ -57,7 +214,7 @@ def colorful_bar_chart(df, category_col, value_col, title):
 
     spec = {
         "title": title,
-        "data": {"values": df.to_dict(orient="records")},
+        "data": {"values": chart_records(df)},
         "mark": {
             "type": "bar",
             "cornerRadiusTopLeft": 6,
@@ -98,17 +255,9 @@ def colorful_bar_chart(df, category_col, value_col, title):
 
 def vega_heatmap(df_props: pd.DataFrame, title: str):
 
-    long = (
-        df_props.reset_index()
-        .melt(id_vars="Teacher_Tag",
-              var_name="DialogAct",
-              value_name="Proportion")
-        .dropna()
-    )
-
     spec = {
         "title": title,
-        "data": {"values": long.to_dict(orient="records")},
+        "data": {"values": heatmap_records(df_props)},
         "mark": "rect",
         "encoding": {
             "x": {
@@ -162,7 +311,8 @@ selected_lessons = st.sidebar.multiselect(
     default=lessons
 )
 
-filtered = data[data["lesson_id"].isin(selected_lessons)].copy()
+applied_lessons = tuple(sorted(selected_lessons))
+aggs = compute_aggregates(applied_lessons)
 
 
 # -----------------------
@@ -171,14 +321,7 @@ filtered = data[data["lesson_id"].isin(selected_lessons)].copy()
 
 with st.expander("📄 View Raw Data (First 50 Rows)"):
     st.dataframe(
-        filtered[
-            [
-                "lesson_id", "TimeStamp", "Turn",
-                "Speaker", "role",
-                "Sentence", "Teacher_Tag",
-                "Student_Tag", "DialogAct"
-            ]
-        ].head(50),
+        preview_table(applied_lessons),
         use_container_width=True
     )
 
@@ -192,32 +335,16 @@ st.header("RQ1. Classroom discourse distribution & dialog acts")
 col1, col2 = st.columns(2)
 
 with col1:
-    rq1_turns = (
-        filtered.groupby("role")
-        .size()
-        .reset_index(name="turn_count")
-    )
-
     colorful_bar_chart(
-        rq1_turns,
+        aggs["rq1_turns"],
         "role",
         "turn_count",
         "Teacher vs Student Turn Frequency"
     )
 
 with col2:
-    da_counts = (
-        filtered["DialogAct"]
-        .dropna()
-        .value_counts()
-        .head(10)
-        .reset_index()
-    )
-
-    da_counts.columns = ["DialogAct", "count"]
-
     colorful_bar_chart(
-        da_counts,
+        aggs["da_counts"],
         "DialogAct",
         "count",
         "DialogAct Distribution"
@@ -230,20 +357,8 @@ with col2:
 
 st.header("RQ2. Patterns in students’ discourse contributions")
 
-students = filtered[filtered["role"] == "student"]
-
-st_counts = (
-    students["Student_Tag"]
-    .dropna()
-    .value_counts()
-    .head(10)
-    .reset_index()
-)
-
-st_counts.columns = ["Student_Tag", "count"]
-
 colorful_bar_chart(
-    st_counts,
+    aggs["st_counts"],
     "Student_Tag",
     "count",
     "Student Tag Distribution"
@@ -256,17 +371,7 @@ colorful_bar_chart(
 
 st.header("RQ3. Teacher instructional intentions × DialogAct")
 
-teachers = filtered[filtered["role"] == "teacher"]
-
-ct_counts = pd.crosstab(
-    teachers["Teacher_Tag"],
-    teachers["DialogAct"]
-)
-
-ct_props = ct_counts.div(ct_counts.sum(axis=1), axis=0).fillna(0)
-ct_props.index.name = "Teacher_Tag"
-
 vega_heatmap(
-    ct_props,
+    aggs["ct_props"],
     "Teacher_Tag × DialogAct (Row Proportions)"
 )
\ No newline at end of file